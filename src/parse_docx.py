@@ -1,17 +1,42 @@
-import docx2txt
 import re
+from itertools import dropwhile
 import pandas as pd
 from docx import Document
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
 import streamlit as st
 
 # REGEX patterns
-speaker_pattern = re.compile(r"[A-ZÄÖÜ .]+:")
+speaker_pattern = re.compile(r"\A[A-ZÄÖÜ][A-ZÄÖÜ .]{0,40}:")
 num_pattern = re.compile(r"\d+\/\d+")
 timestamp_pattern = re.compile(r"\d+:\d+:\d+:\d+")
+time_span_pattern = re.compile(r"\d+:\d+:\d+:\d+\s+-\s+\d+:\d+:\d+:\d+")
 time_duration_pattern = re.compile(
-    r"(?:\d+:\d+:\d+:\d+\s+-\s+\d+:\d+:\d+:\d+)|(?:\d+:\d+:\d+:\d+\s+-\s+\(null\))"
+    r"(\d+:\d+:\d+:\d+)\s+-\s+(\d+:\d+:\d+:\d+|\(null\))"
 )
 
+# Translation table for German umlauts, shared by replace_umlauts and adapt_data
+umlaut_table = str.maketrans(
+    {
+        "ä": "ae",
+        "ü": "ue",
+        "ö": "oe",
+        "ß": "ss",
+        "Ä": "AE",
+        "Ü": "UE",
+        "Ö": "OE",
+    }
+)
+
+# Characters ignored when looking for the first non-empty table cell
+whitespace_table = str.maketrans("", "", "\n\xa0 ")
+
+# Lines that carry no content and are dropped before parsing a take
+empty_lines = frozenset(("\xa0", "", "\xa0 "))
+
+# Speaker labels start with one of these, checked before running speaker_pattern
+speaker_initials = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÜ")
+
 
 def replace_umlauts(text) -> str:
     """replace special German umlauts (vowel mutations) from text.
@@ -20,16 +45,36 @@ def replace_umlauts(text) -> str:
     ö -> oe, Ö -> Oe...
     ß -> ss
     """
-    vowel_char_map = {
-        ord("ä"): "ae",
-        ord("ü"): "ue",
-        ord("ö"): "oe",
-        ord("ß"): "ss",
-        ord("Ä"): "AE",
-        ord("Ü"): "UE",
-        ord("Ö"): "OE",
-    }
-    return text.translate(vowel_char_map)
+    return text.translate(umlaut_table)
+
+
+def split_on_pattern(pattern, text):
+    """
+    Splits text on a compiled pattern with a single scan.
+    Returns:
+        tuple: The list of matches and a generator over the text between them.
+    """
+    matches = list(pattern.finditer(text))
+
+    def segments():
+        last_end = 0
+        for m in matches:
+            yield text[last_end : m.start()]
+            last_end = m.end()
+        yield text[last_end:]
+
+    return matches, segments()
+
+
+def document_text(document, start) -> str:
+    """
+    Joins the text of all paragraphs in document order, including table cells,
+    beginning with the paragraph element start.
+    """
+    paragraphs = dropwhile(
+        lambda p: p is not start, document.element.body.iter(qn("w:p"))
+    )
+    return "\n".join(Paragraph(p, document).text for p in paragraphs)
 
 
 def parse_docx(path, use_streamlit=False) -> tuple[str, list[dict]]:
@@ -41,34 +86,29 @@ def parse_docx(path, use_streamlit=False) -> tuple[str, list[dict]]:
     Returns:
         tuple: A tuple containing the status message and the extracted data.
     """
-    text = docx2txt.process(path)
-
     document = Document(path)
 
+    # The script starts at the first non-empty header cell of the first table
     tables = document.tables
+    start = None
     for i in tables[0].rows[0].cells:
-        stripped = i.text.replace("\n", "").replace("\xa0", "").replace(" ", "")
-        if stripped != "":
-            first_table_text = i.text
+        if i.text.translate(whitespace_table):
+            start = i.paragraphs[0]._p
             break
 
-    success = True
-    try:
-        start_line = text.index(first_table_text) - 1
-        body_text = text[start_line:]
-    except:
-        success = False
-    if re.search(r"\d+:\d+:\d+:\d+", body_text) is None:
+    if start is None:
         return "Error: No timestamps found", None
-    if re.search(r"\d+:\d+:\d+:\d+\s+-\s+\d+:\d+:\d+:\d+", body_text):
+    body_text = document_text(document, start)
+    # A time span implies a timestamp, so only fall back to the plain search
+    if time_span_pattern.search(body_text):
         status, res = parse_takebar_format(body_text, use_streamlit)
+    elif timestamp_pattern.search(body_text) is None:
+        return "Error: No timestamps found", None
     else:
         status, res = parse_tabular_format(body_text, use_streamlit)
 
     if status != "OK":
         return status, None
-    if not success:
-        return "Error: No timestamps found", None
     return status, res
 
 
@@ -81,17 +121,26 @@ def parse_tabular_format(my_text, use_streamlit: bool = True) -> tuple[str, list
 
     if use_streamlit:
         my_bar = st.progress(0, text="Processing...")
+        # Only redraw the bar when the percentage changes
+        last_pct = 0
+
+    sp_match = speaker_pattern.match
+    np_match = num_pattern.match
 
     data = []
-    timestamps = re.findall(timestamp_pattern, my_text)
-    match = re.split(timestamp_pattern, my_text)
+    append = data.append
+    matches, match = split_on_pattern(timestamp_pattern, my_text)
+    timestamps = [m.group() for m in matches]
 
     i = 0
     for m in match:
+        # Take headers are skipped before the segment is split into lines
+        if m.lstrip().startswith("Take "):
+            continue
         # Capitalized alphanumeric string followed by a colon
-        line = [j for j in m.splitlines() if j not in ["\xa0", "", "\xa0 "]]
+        line = [j for j in m.splitlines() if j not in empty_lines]
 
-        if not line or line[0].startswith("Take "):
+        if not line:
             continue
         if i >= len(timestamps):
             break
@@ -99,26 +148,26 @@ def parse_tabular_format(my_text, use_streamlit: bool = True) -> tuple[str, list
         start, end = timestamps[i], timestamps[i + 1]
         i += 2
 
-        while True:
-            if line == []:
-                break
-            old_line = line
-            if speaker_pattern.match(line[0]):
-                speaker = line[0][:-1]
-            elif num_pattern.match(line[0]):
+        pos = 0
+        while pos < len(line):
+            old_pos = pos
+            current = line[pos]
+            if current[:1] in speaker_initials and ":" in current and sp_match(current):
+                speaker = current[:-1]
+            elif np_match(line[pos]):
                 res = {
                     "speaker": "",
                     "dialogue": "",
-                    "take_num": line[0],
+                    "take_num": line[pos],
                     "start": start,
                     "end": end,
                 }
-                data.append(res)
+                append(res)
                 break
             else:
                 break
-            dialogue = line[1]
-            next = 2
+            dialogue = line[pos + 1]
+            next = pos + 2
             if next >= len(line):
                 res = {
                     "speaker": speaker,
@@ -127,21 +176,29 @@ def parse_tabular_format(my_text, use_streamlit: bool = True) -> tuple[str, list
                     "start": start,
                     "end": end,
                 }
-                data.append(res)
+                append(res)
                 break
-            if not re.match(speaker_pattern, line[2]) and not re.match(
-                num_pattern, line[2]
-            ):
-                dialogue += line[2]
-                next = 3
+            following = line[next]
+            if (
+                following[:1] not in speaker_initials
+                or ":" not in following
+                or not sp_match(following)
+            ) and not np_match(following):
+                dialogue += following
+                next += 1
             if next >= len(line):
                 break
-            if re.match(num_pattern, line[next]):
-                take_num = line[next]
-                line = line[next + 1 :]
-            elif re.match(speaker_pattern, line[next]):
+            following = line[next]
+            if np_match(following):
+                take_num = following
+                pos = next + 1
+            elif (
+                following[:1] in speaker_initials
+                and ":" in following
+                and sp_match(following)
+            ):
                 # print("Multiple takes")
-                line = line[next:]
+                pos = next
 
             res = {
                 "speaker": speaker,
@@ -150,13 +207,16 @@ def parse_tabular_format(my_text, use_streamlit: bool = True) -> tuple[str, list
                 "start": start,
                 "end": end,
             }
-            data.append(res)
-            if line == old_line:
+            append(res)
+            if pos == old_pos:
                 print("Something went wrong")
                 break
 
         if use_streamlit:
-            my_bar.progress(int(i / len(timestamps) * 100))
+            pct = i * 100 // len(timestamps)
+            if pct != last_pct:
+                my_bar.progress(pct)
+                last_pct = pct
 
     return "OK", data
 
@@ -171,21 +231,28 @@ def parse_takebar_format(
     """
     if use_streamlit:
         my_bar = st.progress(0, text="Processing...")
+        # Only redraw the bar when the percentage changes
+        last_pct = 0
 
-    timestamps = []
-    for i in re.findall(time_duration_pattern, my_text):
-        a, b = i.split(" - ")
-        timestamps.append(a)
-        timestamps.append(b)
+    matches, match = split_on_pattern(time_duration_pattern, my_text.replace("`", ""))
+    timestamps = [t for m in matches for t in m.groups()]
 
-    match = re.split(time_duration_pattern, my_text.replace("`", ""))
     data = []
+    append = data.append
     i = 0
+    # Continuation lines before the first speaker get an empty role
+    speaker = ""
     for m in match:
         if use_streamlit:
-            my_bar.progress(int(i / len(timestamps) * 100))
-        line = [j for j in m.splitlines() if j not in ["\xa0", "", "\xa0 "]]
-        if not line or line[0].startswith("Take ") or line == [" - "]:
+            pct = i * 100 // len(timestamps)
+            if pct != last_pct:
+                my_bar.progress(pct)
+                last_pct = pct
+        # Take headers are skipped before the segment is split into lines
+        if m.lstrip().startswith("Take "):
+            continue
+        line = [j for j in m.splitlines() if j not in empty_lines]
+        if not line or line == [" - "]:
             continue
         if i >= len(timestamps):
             break
@@ -195,29 +262,27 @@ def parse_takebar_format(
         in_atake = False
         try:
             take_num = line[0].replace(" ", "").replace("‹", "")
-            line = line[1:]
-            while True:
-                if line == []:
-                    break
-                if line[0] == "\t":
-                    line = line[1:]
+            pos = 1
+            while pos < len(line):
+                if line[pos] == "\t":
+                    pos += 1
                     continue
-                if line[0] == "\t":
-                    line = line[1:]
+                if line[pos] == "\t":
+                    pos += 1
                     continue
-                if line[0].find("\t") != -1:
-                    a = line[0].split("\t")
+                if line[pos].find("\t") != -1:
+                    a = line[pos].split("\t")
                 else:
-                    speaker = line[0]
+                    speaker = line[pos]
                     dialogue = ""
-                    line = line[1:]
-                    data.append(
+                    pos += 1
+                    append(
                         {
                             "speaker": speaker,
                             "dialogue": dialogue,
                             "take_num": take_num,
-                            "start": timestamps[i],
-                            "end": timestamps[i + 1],
+                            "start": t0,
+                            "end": t1,
                         }
                     )
                     continue
@@ -239,7 +304,7 @@ def parse_takebar_format(
                         try:
                             speaker = a[1]
                             dialogue = a[2]
-                        except:
+                        except IndexError:
                             speaker = ""
                             dialogue = a[1]
                         note = "A"
@@ -255,7 +320,7 @@ def parse_takebar_format(
                             dialogue = a[1]
                         else:
                             dialogue = ""
-                data.append(
+                append(
                     {
                         "speaker": speaker,
                         "dialogue": dialogue,
@@ -264,10 +329,10 @@ def parse_takebar_format(
                         "end": t1,
                     }
                 )
-                line = line[1:]
-        except:
+                pos += 1
+        except IndexError:
             print("Something went wrong")
-            data.append(
+            append(
                 {
                     "speaker": "",
                     "dialogue": "ERROR",
@@ -284,17 +349,26 @@ def adapt_data(data) -> pd.DataFrame:
     Adapts the data to a DataFrame, renames columns and converts types.
     """
 
-    df = pd.DataFrame(data)
-    df["Typ"] = ""
-
-    for i, row in df.iterrows():
-        if row["take_num"][-1] in ["A", "a", "Ü", "ü"]:
-            df.at[i, "Typ"] = replace_umlauts(row["take_num"][-1])
-            df.at[i, "take_num"] = row["take_num"][:-1]
-        if df.at[i, "take_num"].find("/") != -1:
-            df.at[i, "take_num"] = int(df.at[i, "take_num"].split("/")[1])
-        df.at[i, "speaker"] = replace_umlauts(row["speaker"]).upper()
-        df.at[i, "dialogue"] = replace_umlauts(row["dialogue"])
+    df = pd.DataFrame.from_records(
+        data, columns=["speaker", "dialogue", "take_num", "start", "end"]
+    )
+
+    # A trailing note on the take number marks the take type
+    take_num = df["take_num"]
+    note = take_num.str[-1]
+    has_note = note.isin(["A", "a", "Ü", "ü"])
+    df["Typ"] = pd.Categorical(
+        note.where(has_note, "").str.translate(umlaut_table),
+        categories=["", "A", "a", "UE", "ue"],
+    )
+    df["take_num"] = take_num.where(~has_note, take_num.str[:-1])
+
+    has_slash = df["take_num"].str.contains("/", regex=False)
+    df.loc[has_slash, "take_num"] = (
+        df.loc[has_slash, "take_num"].str.split("/").str[1].astype(int)
+    )
+    df["speaker"] = df["speaker"].str.translate(umlaut_table).str.upper()
+    df["dialogue"] = df["dialogue"].str.translate(umlaut_table)
 
     df.columns = ["Rolle", "Text", "TakeNr", "In", "Out", "Typ"]
     df = df[["TakeNr", "In", "Out", "Typ", "Rolle", "Text"]]